@@ -1,9 +1,30 @@
 import random
+import queue
+import threading
+import traceback
+from collections import defaultdict, Counter
 from typing import List, Dict
 import os
-import pretty_midi
-import soundfile as sf
-import fluidsynth
+import pickle
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# pretty_midi, symusic, soundfile and fluidsynth are imported lazily in
+# the functions that need them, so importing this module (e.g. from the
+# test suite or a training-only run) does not pay their native-library
+# startup cost.
+
+# Lookup tables between MIDI numbers and note names, built once at
+# import time so hot loops do O(1) indexing instead of string formatting;
+# names follow the pretty_midi convention (sharps, C4 = 60)
+_PITCH_CLASSES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+NUM_TO_NAME = [f"{_PITCH_CLASSES[i % 12]}{i // 12 - 1}" for i in range(128)]
+NAME_TO_NUM = {name: i for i, name in enumerate(NUM_TO_NAME)}
+
 
 # ==========================================================
 # Load TXT melodies
@@ -11,9 +32,10 @@ import fluidsynth
 def load_melodies(path: str) -> List[List[str]]:
     """Read melodies from a file and return as list of note lists."""
     try:
-        with open(path, "r") as f:
-            lines = f.readlines()
-            melodies = [line.strip().split() for line in lines]
+        # Stream line by line instead of materializing the whole file;
+        # split() with no argument already strips the trailing newline
+        with open(path, "r", buffering=1 << 20) as f:
+            melodies = [line.split() for line in f]
             print(f"Successfully loaded {len(melodies)} melodies from:", path)
             return melodies
     except FileNotFoundError:
@@ -28,67 +50,193 @@ def load_melodies(path: str) -> List[List[str]]:
 def save_melodies(melodies: List[List[str]], path: str) -> None:
     """Save a list of generated melodies to a text file."""
     with open(path, "w") as f:
-        for melody in melodies:
-            f.write(" ".join(melody) + "\n")
+        # One write call for the whole file instead of one per melody
+        f.write("\n".join(" ".join(melody) for melody in melodies) + "\n")
     print(f"Saved text result:", path)
 
 
 # ==========================================================
 # Extract melody from NES MIDI files
 # ==========================================================
+def _extract_one(midi_path: str) -> List[str] | None:
+    """Extract dominant pitch sequence from a single MIDI file."""
+    import symusic
+
+    try:
+        # symusic parses MIDI in native code, much faster than
+        # pretty_midi for bulk ingestion of the NES corpus
+        score = symusic.Score(midi_path, ttype="tick")
+
+        # Get most active track
+        best = None
+        most_notes = 0
+        for track in score.tracks:
+            if track.is_drum:
+                continue
+            if len(track.notes) > most_notes:
+                best = track
+                most_notes = len(track.notes)
+
+        if best:
+            return [
+                NUM_TO_NAME[pitch]
+                for pitch in best.notes.numpy()["pitch"]
+            ]
+    # symusic raises RuntimeError on malformed MIDI data
+    except (OSError, ValueError, EOFError, KeyError, RuntimeError) as e:
+        print(f"Skipped {os.path.basename(midi_path)}: {e}")
+    return None
+
+
 def extract_melodies_from_midi_folder(folder: str) -> List[List[str]]:
     """Extract dominant pitch sequence from each NES MIDI file."""
-    melodies = []
-    for filename in os.listdir(folder):
-        if filename.endswith(".mid"):
-            midi_path = os.path.join(folder, filename)
-            try:
-                pm = pretty_midi.PrettyMIDI(midi_path)
-
-                # Get most active instrument
-                best = None
-                most_notes = 0
-                for inst in pm.instruments:
-                    if inst.is_drum:
-                        continue
-                    if len(inst.notes) > most_notes:
-                        best = inst
-                        most_notes = len(inst.notes)
-
-                if best:
-                    melody = [
-                        pretty_midi.note_number_to_name(n.pitch)
-                        for n in best.notes
-                    ]
-                    melodies.append(melody)
-                    print("Extracted:", filename)
-            except:
-                print("Skipped (error):", filename)
+    # Reuse cached results from an earlier run if the folder is unchanged
+    cache_path = os.path.normpath(folder) + "_cache.pkl"
+    if os.path.exists(cache_path) and \
+            os.path.getmtime(cache_path) > os.path.getmtime(folder):
+        with open(cache_path, "rb") as f:
+            melodies = pickle.load(f)
+        print(f"Loaded {len(melodies)} cached melodies from:", cache_path)
+        return melodies
+
+    # scandir caches file-type info per entry and is faster than listdir
+    # on the large NES directories; also accept .midi / mixed-case names
+    with os.scandir(folder) as entries:
+        paths = [
+            entry.path
+            for entry in entries
+            if entry.is_file() and entry.name.lower().endswith((".mid", ".midi"))
+        ]
+
+    # Each file is independent, so parse them across all CPU cores
+    with ProcessPoolExecutor() as executor:
+        results = list(executor.map(_extract_one, paths, chunksize=32))
+
+    melodies = [m for m in results if m is not None]
+    print(f"Extracted {len(melodies)} melodies from:", folder)
+
+    with open(cache_path, "wb") as f:
+        pickle.dump(melodies, f)
+
     return melodies
 
 
+# ==========================================================
+# Deduplicate melodies
+# ==========================================================
+def deduplicate_melodies(melodies: List[List[str]]) -> List[List[str]]:
+    """Drop duplicate note sequences (e.g. repeated rips of one tune)."""
+    seen = set()
+    unique = []
+    for melody in melodies:
+        key = tuple(melody)
+        if key not in seen:
+            seen.add(key)
+            unique.append(melody)
+    return unique
+
+
 # ==========================================================
 # Build bigram model
 # ==========================================================
 def build_bigram(melody_sequences: List[List[str]]) -> Dict[str, Dict[str, int]]:
     """Construct bigram transition model."""
-    bigram = {}
+    bigram = defaultdict(Counter)
     for seq in melody_sequences:
-        for i in range(len(seq) - 1):
-            cur_note = seq[i]
-            nxt_note = seq[i + 1]
-            if cur_note not in bigram:
-                bigram[cur_note] = {}
-            bigram[cur_note][nxt_note] = bigram[cur_note].get(nxt_note, 0) + 1
+        for cur_note, nxt_note in zip(seq, seq[1:]):
+            bigram[cur_note][nxt_note] += 1
     print("Bigram keys:", len(bigram))
-    return bigram
+    return dict(bigram)
+
+
+# ==========================================================
+# Prune bigram model
+# ==========================================================
+def prune_bigram(bigram: Dict[str, Dict[str, int]], min_count: int = 2,
+                 top_k: int = None) -> Dict[str, Dict[str, int]]:
+    """Drop rare transitions, optionally keeping only top_k per state."""
+    pruned = {}
+    for cur, row in bigram.items():
+        kept = {n: c for n, c in row.items() if c >= min_count}
+        if top_k is not None and len(kept) > top_k:
+            kept = dict(sorted(kept.items(), key=lambda x: -x[1])[:top_k])
+        if kept:
+            pruned[cur] = kept
+    return pruned
 
 
 # ==========================================================
 # Weighted selection
 # ==========================================================
-def weighted_choice(dic):
-    return random.choices(list(dic.keys()), list(dic.values()), k=1)[0]
+def _compile_bigram(bigram: dict, start_note: str):
+    """Compile a bigram dict into integer-id numpy sampling tables.
+
+    Returns (id_to_name, name_to_id, rows, state_ids) where rows[i] is
+    a (next ids, cumulative weights) array pair, or None for dead ends.
+    """
+    id_to_name = list({n for row in bigram.values() for n in row} | set(bigram))
+    if start_note not in id_to_name:
+        id_to_name.append(start_note)
+    name_to_id = {name: i for i, name in enumerate(id_to_name)}
+
+    rows = [None] * len(id_to_name)
+    for cur, row in bigram.items():
+        next_ids = np.fromiter((name_to_id[n] for n in row), dtype=np.int32)
+        cum = np.cumsum(np.fromiter(row.values(), dtype=np.float64))
+        rows[name_to_id[cur]] = (next_ids, cum)
+    state_ids = np.fromiter((name_to_id[n] for n in bigram), dtype=np.int32)
+
+    return id_to_name, name_to_id, rows, state_ids
+
+
+def _compile_bigram_csr(bigram: dict, start_note: str):
+    """Flatten the per-state rows into one CSR-style array triple."""
+    id_to_name, name_to_id, rows, state_ids = _compile_bigram(bigram, start_note)
+
+    row_ptr = np.zeros(len(id_to_name) + 1, dtype=np.int32)
+    for i, row in enumerate(rows):
+        row_ptr[i + 1] = row_ptr[i] + (len(row[0]) if row is not None else 0)
+
+    col_ids = np.empty(row_ptr[-1], dtype=np.int32)
+    cum_w = np.empty(row_ptr[-1], dtype=np.float64)
+    for i, row in enumerate(rows):
+        if row is not None:
+            col_ids[row_ptr[i]:row_ptr[i + 1]] = row[0]
+            cum_w[row_ptr[i]:row_ptr[i + 1]] = row[1]
+
+    return id_to_name, name_to_id, row_ptr, col_ids, cum_w, state_ids
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _sample_csr(row_ptr, col_ids, cum_w, state_ids, start, length, seed):
+        np.random.seed(seed)
+        out = np.empty(length + 1, dtype=np.int32)
+        out[0] = start
+        curr = start
+        for i in range(length):
+            s = row_ptr[curr]
+            e = row_ptr[curr + 1]
+            if e > s:
+                u = np.random.random() * cum_w[e - 1]
+                curr = col_ids[s + np.searchsorted(cum_w[s:e], u)]
+            else:
+                curr = state_ids[np.random.randint(0, len(state_ids))]
+            out[i + 1] = curr
+        return out
+
+
+def weighted_choice(row: tuple) -> int:
+    next_ids, cum = row
+    u = random.random() * cum[-1]
+    # Sparse bigram rows are usually tiny; a linear scan beats the
+    # fixed call overhead of numpy searchsorted at small sizes
+    if len(cum) <= 8:
+        for i in range(len(cum)):
+            if u < cum[i]:
+                return int(next_ids[i])
+        return int(next_ids[-1])
+    return int(next_ids[np.searchsorted(cum, u, side="right")])
 
 
 # ==========================================================
@@ -106,18 +254,74 @@ def birthday_to_start_note_and_length(birthday: str) -> tuple[str, int]:
 # ==========================================================
 # Generate melody
 # ==========================================================
-def generate_melody(bigram: dict, start_note: str, length: int = 12) -> List[str]:
-    melody = [start_note]
-    curr = start_note
+def generate_melody(bigram: dict, start_note: str, length: int = 12,
+                    min_count: int = 1, top_k: int = None) -> List[str]:
+    # Optionally trim rare transitions so the sampling tables stay small
+    if min_count > 1 or top_k is not None:
+        bigram = prune_bigram(bigram, min_count=min_count, top_k=top_k)
+
+    # JIT-compiled sampling loop over the CSR tables when numba is present
+    if njit is not None:
+        id_to_name, name_to_id, row_ptr, col_ids, cum_w, state_ids = \
+            _compile_bigram_csr(bigram, start_note)
+        ids = _sample_csr(row_ptr, col_ids, cum_w, state_ids,
+                          name_to_id[start_note], length,
+                          random.randrange(2 ** 31))
+        return [id_to_name[i] for i in ids]
+
+    # Sample over integer ids; names are only looked up at the end
+    id_to_name, name_to_id, rows, state_ids = _compile_bigram(bigram, start_note)
+
+    curr = name_to_id[start_note]
+    ids = [curr]
 
     for _ in range(length):
-        if curr in bigram and bigram[curr]:
-            curr = weighted_choice(bigram[curr])
+        row = rows[curr]
+        if row is not None:
+            curr = weighted_choice(row)
         else:
-            curr = random.choice(list(bigram.keys()))
-        melody.append(curr)
+            curr = int(random.choice(state_ids))
+        ids.append(curr)
 
-    return melody
+    return [id_to_name[i] for i in ids]
+
+
+# ==========================================================
+# Generate melodies in batch
+# ==========================================================
+def generate_melodies(bigram: dict, start_note: str, length: int = 12,
+                      count: int = 1, min_count: int = 1,
+                      top_k: int = None) -> List[List[str]]:
+    """Generate `count` melodies at once with vectorized sampling."""
+    if count == 1:
+        return [generate_melody(bigram, start_note, length, min_count, top_k)]
+
+    if min_count > 1 or top_k is not None:
+        bigram = prune_bigram(bigram, min_count=min_count, top_k=top_k)
+
+    id_to_name, name_to_id, rows, state_ids = _compile_bigram(bigram, start_note)
+
+    rng = np.random.default_rng()
+    curr = np.full(count, name_to_id[start_note], dtype=np.int32)
+    out = np.empty((count, length + 1), dtype=np.int32)
+    out[:, 0] = curr
+
+    for step in range(length):
+        nxt = np.empty(count, dtype=np.int32)
+        # Group samples by state so each row is sampled in one numpy call
+        for state in np.unique(curr):
+            mask = curr == state
+            row = rows[state]
+            if row is not None:
+                next_ids, cum = row
+                u = rng.random(mask.sum()) * cum[-1]
+                nxt[mask] = next_ids[np.searchsorted(cum, u, side="right")]
+            else:
+                nxt[mask] = rng.choice(state_ids, size=mask.sum())
+        curr = nxt
+        out[:, step + 1] = curr
+
+    return [[id_to_name[i] for i in row] for row in out]
 
 
 # ==========================================================
@@ -125,26 +329,23 @@ def generate_melody(bigram: dict, start_note: str, length: int = 12) -> List[str
 # ==========================================================
 def write_melody_to_midi(melody: List[str], midi_path: str):
     """Save melody to MIDI file."""
+    import pretty_midi
+
     pm = pretty_midi.PrettyMIDI()
     inst = pretty_midi.Instrument(program=0)
 
-    start = 0.0
-    dur = 0.5
-
-    for note in melody:
-        try:
-            midi_n = pretty_midi.note_name_to_number(note)
-        except:
-            continue
-
-        inst.notes.append(pretty_midi.Note(
-            pitch=midi_n,
-            velocity=100,
-            start=start,
-            end=start + dur
-        ))
-        start += dur
-
+    # Compute the note timing grid in one shot, then bulk-build Notes
+    pitches = np.fromiter(
+        (NAME_TO_NUM[n] for n in melody if n in NAME_TO_NUM),
+        dtype=np.int16,
+    )
+    starts = np.arange(len(pitches), dtype=np.float64) * 0.5
+    ends = starts + 0.5
+
+    inst.notes = [
+        pretty_midi.Note(pitch=int(p), velocity=100, start=float(s), end=float(e))
+        for p, s, e in zip(pitches, starts, ends)
+    ]
     pm.instruments.append(inst)
     pm.write(midi_path)
     print("MIDI file written:", midi_path)
@@ -153,33 +354,89 @@ def write_melody_to_midi(melody: List[str], midi_path: str):
 # ==========================================================
 # Save as WAV
 # ==========================================================
+_FS = None
+
+
+def _get_fs(soundfont_path: str):
+    """Return a shared FluidSynth instance with the soundfont loaded."""
+    import fluidsynth
+
+    global _FS
+    if _FS is None:
+        _FS = fluidsynth.Synth(samplerate=44100)
+        sfid = _FS.sfload(soundfont_path)
+        _FS.program_select(0, sfid, 0, 0)
+    return _FS
+
+
 def write_melody_to_wav(melody: List[str], wav_path: str, soundfont_path="data/GeneralUser.sf2"):
     """Render melody into WAV using FluidSynth."""
-    pm = pretty_midi.PrettyMIDI()
-    inst = pretty_midi.Instrument(program=0)
+    import soundfile as sf
+
+    # Reuse one synth across calls so the ~30 MB soundfont loads once
+    fs = _get_fs(soundfont_path)
+    sample_rate = 44100
+    samples_per_note = int(0.5 * sample_rate)
+
+    # Fill one preallocated buffer instead of concatenating per-note chunks
+    pitches = [NAME_TO_NUM[n] for n in melody if n in NAME_TO_NUM]
+    audio_data = np.empty((len(pitches) * samples_per_note, 2), dtype=np.int16)
+
+    for i, midi_n in enumerate(pitches):
+        fs.noteon(0, midi_n, 100)
+        chunk = fs.get_samples(samples_per_note)
+        fs.noteoff(0, midi_n)
+        audio_data[i * samples_per_note:(i + 1) * samples_per_note] = \
+            chunk.reshape(-1, 2)
+
+    # Samples are already int16, so PCM_16 writes them straight through
+    # with no per-sample conversion inside libsndfile
+    sf.write(wav_path, audio_data, sample_rate, subtype="PCM_16")
+    print("WAV file written:", wav_path)
 
-    start = 0.0
-    dur = 0.5
 
-    for note in melody:
-        try:
-            midi_n = pretty_midi.note_name_to_number(note)
-        except:
-            continue
-        inst.notes.append(pretty_midi.Note(
-            velocity=100,
-            pitch=midi_n,
-            start=start,
-            end=start + dur
-        ))
-        start += dur
+# ==========================================================
+# Background WAV rendering
+# ==========================================================
+_WAV_QUEUE = None
+_WAV_ERRORS = []
 
-    pm.instruments.append(inst)
 
-    # Render to audio
-    audio_data = pm.fluidsynth(fs=44100, sf2_path=soundfont_path)
-    sf.write(wav_path, audio_data, 44100)
-    print("WAV file written:", wav_path)
+def _wav_worker():
+    while True:
+        melody, wav_path, soundfont_path = _WAV_QUEUE.get()
+        try:
+            write_melody_to_wav(melody, wav_path, soundfont_path)
+        except Exception as e:
+            # Keep the worker alive so one bad render cannot stall the
+            # queue; the failure is reported by wait_for_wav_writes
+            traceback.print_exc()
+            _WAV_ERRORS.append((wav_path, e))
+        finally:
+            _WAV_QUEUE.task_done()
+
+
+def write_melody_to_wav_async(melody: List[str], wav_path: str,
+                              soundfont_path="data/GeneralUser.sf2"):
+    """Queue a WAV render on a background thread and return immediately."""
+    global _WAV_QUEUE
+    if _WAV_QUEUE is None:
+        _WAV_QUEUE = queue.Queue(maxsize=8)
+        threading.Thread(target=_wav_worker, daemon=True).start()
+    _WAV_QUEUE.put((melody, wav_path, soundfont_path))
+
+
+def wait_for_wav_writes():
+    """Block until every queued WAV render has been written.
+
+    Raises the first render error, if any, so failures are not silent.
+    """
+    if _WAV_QUEUE is not None:
+        _WAV_QUEUE.join()
+    if _WAV_ERRORS:
+        wav_path, error = _WAV_ERRORS[0]
+        _WAV_ERRORS.clear()
+        raise RuntimeError(f"WAV render failed for {wav_path}") from error
 
 
 # ==========================================================
@@ -188,7 +445,7 @@ def write_melody_to_wav(melody: List[str], wav_path: str, soundfont_path="data/G
 def main():
     txt = load_melodies("data/melodies.txt")
     midi = extract_melodies_from_midi_folder("data/nesmdb_midi/")
-    all_data = txt + midi
+    all_data = deduplicate_melodies(txt + midi)
 
     bigram = build_bigram(all_data)
 
@@ -206,9 +463,12 @@ def main():
     os.makedirs(output_dir, exist_ok=True)
 
     # save files
+    # WAV rendering runs on a background thread while the other
+    # formats are written; wait for it before exiting
+    write_melody_to_wav_async(melody, f"{output_dir}/{birthday}melody.wav")
     save_melodies([melody], f"{output_dir}/{birthday}melody.txt")
     write_melody_to_midi(melody, f"{output_dir}/{birthday}melody.mid")
-    write_melody_to_wav(melody, f"{output_dir}/{birthday}melody.wav")
+    wait_for_wav_writes()
 
 
 if __name__ == "__main__":
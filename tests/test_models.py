@@ -1,6 +1,6 @@
 import unittest
 import os
-from composer import load_melodies, save_melodies, build_bigram, generate_melody
+from composer import load_melodies, save_melodies, build_bigram, generate_melody, generate_melodies, deduplicate_melodies, prune_bigram
 
 class TestMelodyGenerator(unittest.TestCase):
 
@@ -21,6 +21,11 @@ class TestMelodyGenerator(unittest.TestCase):
 
         os.remove(test_file)
 
+    def test_deduplicate_melodies(self):
+        """Ensure duplicate sequences are dropped, keeping first occurrence"""
+        melodies = [["C4","E4"], ["A4","B4"], ["C4","E4"]]
+        self.assertEqual(deduplicate_melodies(melodies), [["C4","E4"], ["A4","B4"]])
+
     def test_bigram_count(self):
         """Ensure bigram counts transitions"""
         melodies = [
@@ -33,6 +38,21 @@ class TestMelodyGenerator(unittest.TestCase):
         self.assertEqual(bigram["E4"]["G4"], 1)
         self.assertEqual(bigram["E4"]["C5"], 1)
 
+    def test_prune_bigram(self):
+        """Ensure rare transitions and emptied states are removed"""
+        bigram = {"C4": {"E4": 5, "G4": 1}, "D4": {"A4": 1}}
+        pruned = prune_bigram(bigram, min_count=2)
+        self.assertEqual(pruned, {"C4": {"E4": 5}})
+
+    def test_generated_melodies_batch(self):
+        """Ensure batch generation returns the requested count and lengths"""
+        bigram = {"C4": {"E4": 1}, "E4": {"C4": 1}}
+        melodies = generate_melodies(bigram, "C4", length=8, count=5)
+        self.assertEqual(len(melodies), 5)
+        for melody in melodies:
+            self.assertEqual(len(melody), 9)
+            self.assertEqual(melody[0], "C4")
+
     def test_generated_melody_length(self):
         """Ensure generated melody has expected length"""
         bigram = {"C4": {"E4": 1}, "E4": {"C4": 1}}